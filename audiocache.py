@@ -0,0 +1,89 @@
+import logging
+import os
+from collections import Counter, OrderedDict
+
+# The suffix of files that are still being written
+PARTIAL = '.part'
+
+class AudioCache():
+    """Downloaded audio files, evicted least recently used first once they outgrow a size cap."""
+    def __init__(self, path, size):
+        self.path = path
+        self.size = size
+        self.files = OrderedDict()
+        self.total = 0
+        self.pinned = Counter()
+
+        self.hits = 0
+        self.misses = 0
+
+        # Pick up files from earlier sessions, oldest first, dropping any the bot stopped midway through
+        os.makedirs(path, exist_ok=True)
+        entries = []
+        for entry in os.scandir(path):
+            if not entry.is_file():
+                continue
+            if entry.name.endswith(PARTIAL):
+                os.remove(entry.path)
+            else:
+                entries.append(entry)
+        entries.sort(key=lambda entry: max(entry.stat().st_atime, entry.stat().st_mtime))
+        for entry in entries:
+            self.files[entry.name] = entry.stat().st_size
+            self.total += entry.stat().st_size
+        self.evict()
+
+    def __contains__(self, name):
+        return name in self.files
+
+    def file(self, name):
+        return os.path.join(self.path, name)
+
+    def partial(self, name):
+        """Get the path a file is written to before it is finished."""
+        return self.file(name) + PARTIAL
+
+    def lookup(self, name):
+        """Get the path of a cached file and mark it as recently used, or None if it isn't cached."""
+        if name not in self.files:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self.files.move_to_end(name)
+        return self.file(name)
+
+    def add(self, name):
+        """Record a file that has finished downloading."""
+        try:
+            size = os.path.getsize(self.file(name))
+        except OSError:
+            return
+
+        self.total += size - self.files.get(name, 0)
+        self.files[name] = size
+        self.files.move_to_end(name)
+        self.evict()
+
+    def pin(self, name):
+        """Protect a file from eviction while it is being played."""
+        self.pinned[name] += 1
+
+    def unpin(self, name):
+        self.pinned[name] -= 1
+        if self.pinned[name] <= 0:
+            del self.pinned[name]
+
+    def evict(self):
+        """Delete the least recently used unpinned files until the cache fits its cap."""
+        for name in list(self.files):
+            if self.total <= self.size:
+                break
+            if name in self.pinned:
+                continue
+
+            try:
+                os.remove(self.file(name))
+            except OSError as e:
+                logging.error(e)
+            self.total -= self.files.pop(name)
@@ -0,0 +1,47 @@
+import common
+
+import logging
+import os
+import time
+
+# How often, in seconds, to check whether the auto-roles file has changed
+RELOAD_INTERVAL = 5
+
+class Autoroles():
+    """The auto-roles file, indexed by (message ID, emoji) and reloaded when it changes."""
+    def __init__(self, path):
+        self.path = path
+        self.checked = time.monotonic()
+        self.load()
+
+    def load(self):
+        """Read the auto-roles file and rebuild the index."""
+        mtime = os.stat(self.path).st_mtime
+        autoroles = common.read_json(self.path)['autoroles']
+
+        index = {}
+        for autorole in autoroles:
+            for emoji, role in zip(autorole['reactions'], autorole['roles']):
+                index[(autorole['message'], emoji)] = role
+
+        # Swap everything in at once so a failed reload leaves the old index intact
+        self.autoroles, self.index, self.mtime = autoroles, index, mtime
+
+    def refresh(self):
+        """Reload the file if it has changed since it was last read."""
+        now = time.monotonic()
+        if now - self.checked < RELOAD_INTERVAL:
+            return
+        self.checked = now
+
+        try:
+            if os.stat(self.path).st_mtime != self.mtime:
+                self.load()
+                logging.info('Auto-roles reloaded')
+        except (OSError, ValueError, KeyError) as e:
+            logging.error(f'Failed to reload auto-roles: {e}')
+
+    def get_role_id(self, message_id, emoji):
+        """Get the ID of the role an auto-role reaction stands for, or None if it isn't one."""
+        self.refresh()
+        return self.index.get((message_id, emoji))
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""Benchmark the database module against a synthetic guild.
+
+Each scale seeds a temporary database with that many members, reminders and
+birthdays, then times the real database functions and prints one JSON object
+per operation.
+"""
+
+import database
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone
+
+FakeMember = namedtuple('FakeMember', ['id'])
+
+START = datetime(2030, 1, 1, tzinfo=timezone.utc)
+SPREAD = timedelta(days=365)
+
+def percentile(samples, fraction):
+    """Get a percentile from a sorted list of samples."""
+    index = min(len(samples) - 1, int(round(fraction * (len(samples) - 1))))
+    return samples[index]
+
+def report(operation, scale, latencies, rows=None):
+    """Summarise a list of per-call latencies in seconds as a dictionary."""
+    latencies = sorted(latencies)
+    total = sum(latencies)
+    result = {
+        'operation': operation,
+        'scale': scale,
+        'calls': len(latencies),
+        'throughput': len(latencies) / total if total else None,
+        'p50_ms': percentile(latencies, 0.50) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+        'mean_ms': statistics.mean(latencies) * 1000,
+    }
+    if rows is not None:
+        result['rows'] = rows
+    return result
+
+def random_time(generator):
+    return START + timedelta(seconds=generator.randrange(int(SPREAD.total_seconds())))
+
+def seed(path, scale, generator):
+    """Fill a database with members, reminders and birthdays."""
+    members = [(id,) for id in range(1, scale + 1)]
+    reminders = [
+        (f'Reminder {id}', generator.randrange(1, scale + 1), int(random_time(generator).timestamp()))
+        for id in range(scale)
+    ]
+    birthdays = []
+    for (id,) in members:
+        date = random_time(generator)
+        birthdays.append((id, date.strftime('%Y-%m-%d'), date.strftime('%m-%d')))
+
+    for chunk in database.chunks(members, database.MEMBER_CHUNK_SIZE):
+        with database.db(path) as cursor:
+            cursor.executemany(database.statements['add-member'], chunk)
+    with database.db(path) as cursor:
+        cursor.executemany(database.statements['add-reminder'], reminders)
+        cursor.executemany(database.statements['add-birthday'], birthdays)
+
+async def timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = await func(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+async def run_scale(sync_path, path, scale, iterations, generator):
+    results = []
+    members = [FakeMember(id) for id in range(1, scale + 1)]
+
+    # Initial sync into an empty table, then a no-op resync and a small delta
+    latency, (added, removed) = await timed(database.update_members, members, sync_path)
+    results.append(report('update_members (initial)', scale, [latency], rows=added))
+
+    latency, (added, removed) = await timed(database.update_members, members, sync_path)
+    results.append(report('update_members (unchanged)', scale, [latency], rows=added + removed))
+
+    delta = max(1, scale // 100)
+    changed = members[delta:] + [FakeMember(scale + id) for id in range(1, delta + 1)]
+    latency, (added, removed) = await timed(database.update_members, changed, sync_path, prune=True)
+    results.append(report('update_members (1% delta)', scale, [latency], rows=added + removed))
+
+    seed(path, scale, generator)
+
+    latencies = []
+    for _ in range(iterations):
+        latency, rows = await timed(database.get_reminders, random_time(generator), path)
+        latencies.append(latency)
+    results.append(report('get_reminders', scale, latencies))
+
+    latencies = []
+    for _ in range(iterations):
+        latency, rows = await timed(database.get_pending_reminders, path)
+        latencies.append(latency)
+    results.append(report('get_pending_reminders', scale, latencies, rows=len(rows)))
+
+    latencies = []
+    for iteration in range(iterations):
+        limit = START + SPREAD * (iteration + 1) / (iterations * 10)
+        latency, _ = await timed(database.delete_reminders, limit, path)
+        latencies.append(latency)
+    results.append(report('delete_reminders', scale, latencies))
+
+    latencies = []
+    for _ in range(iterations):
+        database.birthday_cache.clear()
+        latency, rows = await timed(database.get_birthdays, random_time(generator), path)
+        latencies.append(latency)
+    results.append(report('get_birthdays (uncached)', scale, latencies))
+
+    latencies = []
+    date = random_time(generator)
+    for _ in range(iterations):
+        latency, rows = await timed(database.get_birthdays, date, path)
+        latencies.append(latency)
+    results.append(report('get_birthdays (cached)', scale, latencies))
+
+    latencies = []
+    for _ in range(iterations):
+        member = FakeMember(generator.randrange(1, scale + 1))
+        latency, _ = await timed(database.add_birthday, member, random_time(generator), path)
+        latencies.append(latency)
+    results.append(report('add_birthday', scale, latencies))
+
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scales', default='1000,100000', help='comma-separated row counts (default: 1000,100000)')
+    parser.add_argument('--iterations', type=int, default=100, help='calls per timed operation (default: 100)')
+    parser.add_argument('--synchronous', default=database.SYNCHRONOUS, help='SQLite synchronous mode to test')
+    parser.add_argument('--seed', type=int, default=0, help='random seed for the synthetic data')
+    args = parser.parse_args()
+
+    scales = [int(scale) for scale in args.scales.split(',')]
+    generator = random.Random(args.seed)
+
+    with tempfile.TemporaryDirectory() as directory:
+        for scale in scales:
+            sync_path = os.path.join(directory, f'members-{scale}.db')
+            path = os.path.join(directory, f'guild-{scale}.db')
+            database.setup(sync_path, synchronous=args.synchronous)
+            database.setup(path, synchronous=args.synchronous)
+
+            for result in asyncio.run(run_scale(sync_path, path, scale, args.iterations, generator)):
+                result['synchronous'] = args.synchronous
+                print(json.dumps(result), flush=True)
+
+        database.close()
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,15 +1,17 @@
-from database import db
-
 import functools
 import json
 import logging
 import os
 import re
+from collections import OrderedDict
 from datetime import timedelta
 
 import discord
 import sqlite3
 
+DM_CACHE_SIZE = 1000
+URL_EXPRESSION = re.compile(r'https?://[a-z0-9\.]+\.[a-z0-9]', re.IGNORECASE)
+
 def read_json(path):
     """Read JSON from a file into a Python object."""
     with open(path, 'r') as data_file:
@@ -27,9 +29,10 @@ def read_file(path):
 
 def has_url(text):
     """Checks whether a piece of text contains a URL."""
-    link_expression = re.compile(r'https?://[a-z0-9\.]+\.[a-z0-9]')
-    contains_link = link_expression.search(text.lower()) != None
-    return contains_link
+    # Every URL contains '://', which is much cheaper to look for than running the pattern
+    if '://' not in text:
+        return False
+    return URL_EXPRESSION.search(text) != None
 
 def extract_time(current_time, text):
     """Attempt to extract a relative point in time from a string."""
@@ -84,24 +87,40 @@ def create_embed(options, inline=True, color=None):
 
     return embed
 
+class DMChannels():
+    """A least-recently-used cache of DM channels keyed by user ID."""
+    def __init__(self, size=DM_CACHE_SIZE):
+        self.size = size
+        self.channels = OrderedDict()
+
+    async def get(self, recipient):
+        """Get the DM channel for a user, only asking Discord on a cache miss."""
+        channel = self.channels.get(recipient.id)
+        if channel:
+            self.channels.move_to_end(recipient.id)
+            return channel
+
+        channel = await recipient.create_dm()
+        self.channels[recipient.id] = channel
+        if len(self.channels) > self.size:
+            self.channels.popitem(last=False)
+        return channel
+
+    def invalidate(self, recipient):
+        self.channels.pop(recipient.id, None)
+
+dm_channels = DMChannels()
+
 async def send_dm_embed(embed, recipient):
     """Send an embed to a member."""
-    dm = await recipient.create_dm()
-    await dm.send(embed=embed)
+    dm = await dm_channels.get(recipient)
+    try:
+        await dm.send(embed=embed)
+    except discord.Forbidden:
+        dm_channels.invalidate(recipient)
+        raise
 
 def hex_to_color(hex):
     """Generate a Discord color object from a hex triplet string."""
     red, green, blue = bytes.fromhex(hex.lstrip('#'))
     return discord.Color.from_rgb(red, green, blue)
-
-def get_autorole_data(message_id, autoroles):
-    """Get data about an auto-role from its message ID."""
-    for autorole in autoroles:
-        if message_id == autorole['message']:
-            return autorole
-
-def get_autorole_role_from_reaction(emoji, autorole_data, guild):
-    """Get the role represented by an auto-role reaction."""
-    for reaction, role in zip(autorole_data['reactions'], autorole_data['roles']):
-        if emoji == reaction:
-            return guild.get_role(role)
@@ -1,100 +1,375 @@
-import common
-
+import asyncio
+import functools
+import json
 import logging
 import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 import sqlite3
 
+QUERIES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'queries')
+REQUIRED_STATEMENTS = [
+    'init',
+    'create-table-roles',
+    'create-table-members',
+    'create-table-reminders',
+    'create-table-birthdays',
+    'select-version',
+    'select-track-cache',
+    'touch-track-cache',
+    'add-track-cache',
+    'expire-track-cache',
+    'evict-track-cache',
+    'add-member',
+    'delete-member',
+    'select-member-ids',
+    'select-member',
+    'add-role',
+    'set-role',
+    'exists-role',
+    'delete-role',
+    'null-role',
+    'add-reminder',
+    'select-reminders',
+    'select-pending-reminders',
+    'delete-reminders',
+    'delete-reminder',
+    'add-birthday',
+    'exists-birthday',
+    'update-birthday',
+    'select-birthdays',
+]
+
+MEMBER_CHUNK_SIZE = 1000
+
+JOURNAL_MODE = 'WAL'
+SYNCHRONOUS = 'NORMAL'
+
+class Statements():
+    """The SQL statements in the queries directory, read once and looked up by name."""
+    def __init__(self, directory=QUERIES, required=REQUIRED_STATEMENTS):
+        self.directory = directory
+        self.statements = {}
+
+        for file_name in sorted(os.listdir(directory)):
+            name, extension = os.path.splitext(file_name)
+            if extension != '.sql':
+                continue
+
+            with open(os.path.join(directory, file_name), 'r') as file:
+                statement = file.read()
+            if not sqlite3.complete_statement(statement.rstrip().rstrip(';') + ';'):
+                raise ValueError(f'Incomplete SQL statement in {file_name}')
+            self.statements[name] = statement
+
+        missing = [name for name in required if name not in self.statements]
+        if missing:
+            raise FileNotFoundError(f'Missing queries in {directory}: {", ".join(missing)}')
+
+    def __getitem__(self, name):
+        return self.statements[name]
+
+    def __contains__(self, name):
+        return name in self.statements
+
+    def __iter__(self):
+        return iter(self.statements)
+
+statements = Statements()
+
+# Every query runs on this single thread, so the event loop never waits on disk
+# and the shared connections are never used from two threads at once.
+executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='database')
+connections = {}
+birthday_cache = {}
+
+class Connection():
+    """A long-lived SQLite connection shared by every query against one file."""
+    def __init__(self, file, journal_mode=JOURNAL_MODE, synchronous=SYNCHRONOUS):
+        self.file = file
+        self.lock = threading.RLock()
+        self.connection = sqlite3.connect(file, check_same_thread=False)
+        self.connection.execute(f'PRAGMA journal_mode={journal_mode}')
+        self.connection.execute(f'PRAGMA synchronous={synchronous}')
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+def connect(file, **pragmas):
+    """Get the shared connection to a database file, opening it if needed."""
+    if file not in connections:
+        connections[file] = Connection(file, **pragmas)
+    return connections[file]
+
+def close():
+    """Close every shared connection."""
+    for connection in connections.values():
+        connection.close()
+    connections.clear()
+
 class db():
     """A SQLite context manager."""
     def __init__(self, file='data.db'):
         self.file = file
     def __enter__(self):
-        self.connection = sqlite3.connect(self.file)
-        return self.connection.cursor()
+        self.shared = connect(self.file)
+        self.shared.lock.acquire()
+        self.cursor = self.shared.connection.cursor()
+        return self.cursor
     def __exit__(self, type, value, traceback):
-        self.connection.commit()
-        self.connection.close()
+        try:
+            if type is None:
+                self.shared.connection.commit()
+            else:
+                self.shared.connection.rollback()
+        finally:
+            self.cursor.close()
+            self.shared.lock.release()
+
+async def run(func, *args, **kwargs):
+    """Run a blocking database function on the database thread."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, functools.partial(func, *args, **kwargs))
+
+def threaded(func):
+    """Turn a blocking database function into a coroutine that runs off the event loop."""
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        return await run(func, *args, **kwargs)
+    return wrapper
 
-def setup(path):
-    """Sets up a database if it doesn't already exist."""
-    if not os.path.exists(path):
+def setup(path, journal_mode=JOURNAL_MODE, synchronous=SYNCHRONOUS):
+    """Sets up a database if it doesn't already exist and brings its schema up to date."""
+    exists = os.path.exists(path)
+    connect(path, journal_mode=journal_mode, synchronous=synchronous)
+
+    if not exists:
         with db(path) as cursor:
             query_list = [
-                'queries/init.sql',
-                'queries/create-table-roles.sql',
-                'queries/create-table-members.sql',
-                'queries/create-table-reminders.sql',
-                'queries/create-table-birthdays.sql',
+                'init',
+                'create-table-roles',
+                'create-table-members',
+                'create-table-reminders',
+                'create-table-birthdays',
             ]
 
-            for query_path in query_list:
-                query = common.read_file(query_path)
-                cursor.execute(query)
+            for query_name in query_list:
+                cursor.execute(statements[query_name])
 
             logging.info('Set up database!')
 
-def update_members(members, db_path):
-    """Update 'members' database table from a list of members."""
+    migrate(path)
+
+def migrations():
+    """List the numbered migrations in the queries directory as (version, name) pairs."""
+    found = []
+    for name in statements:
+        match = re.match(r'^migration-(\d+)', name)
+        if match:
+            found.append((int(match.group(1)), name))
+    return sorted(found)
+
+def migrate(path):
+    """Apply every migration newer than the database's user_version, each in its own transaction."""
+    with db(path) as cursor:
+        version = cursor.execute(statements['select-version']).fetchone()[0]
+
+        for number, name in migrations():
+            if number <= version:
+                continue
+
+            cursor.executescript(
+                'BEGIN;\n'
+                f'{statements[name].rstrip().rstrip(";")};\n'
+                f'PRAGMA user_version = {number};\n'
+                'COMMIT;'
+            )
+            logging.info(f'Applied database migration {name}')
+
+def chunks(items, size):
+    """Split a list into consecutive lists of at most a certain size."""
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+@threaded
+def update_members(members, db_path, prune=False):
+    """Update 'members' database table from a list of members.
+
+    Only the difference between the given members and the stored ones is written,
+    in chunked transactions. With `prune`, stored members that are no longer present
+    are removed unless something still refers to them.
+    Returns the number of members added and removed.
+    """
+    member_ids = {member.id for member in members}
+
     with db(db_path) as cursor:
-        for member in members:
-            query = common.read_file('queries/exists-member.sql')
-            member_exists = cursor.execute(query, (member.id,)).fetchone()
-            if member_exists[0] == 0:
-                query = common.read_file('queries/add-member.sql')
-                cursor.execute(query, (member.id,))
-        logging.info('Database updated!')
+        stored_ids = {row[0] for row in cursor.execute(statements['select-member-ids'])}
+
+    added = 0
+    for chunk in chunks(sorted(member_ids - stored_ids), MEMBER_CHUNK_SIZE):
+        with db(db_path) as cursor:
+            cursor.executemany(statements['add-member'], [(id,) for id in chunk])
+            added += cursor.rowcount
+
+    removed = 0
+    if prune:
+        for chunk in chunks(sorted(stored_ids - member_ids), MEMBER_CHUNK_SIZE):
+            with db(db_path) as cursor:
+                cursor.executemany(statements['delete-member'], [(id,) for id in chunk])
+                removed += cursor.rowcount
 
+    logging.info(f'Database updated! ({added} members added, {removed} removed)')
+    return added, removed
+
+@threaded
 def add_member(member, db_path):
     """Add a new member to the database."""
     with db(db_path) as cursor:
-        query = common.read_file('queries/add-member.sql')
+        query = statements['add-member']
         cursor.execute(query, (member.id,))
 
+@threaded
+def get_member_role(member, db_path):
+    """Get the ID of a member's custom role, or None if they have none."""
+    with db(db_path) as cursor:
+        query = statements['select-member']
+        return cursor.execute(query, (member.id,)).fetchone()[0]
+
+@threaded
+def set_member_role(member, role, db_path):
+    """Record a newly created custom role for a member."""
+    with db(db_path) as cursor:
+        query = statements['add-role']
+        cursor.execute(query, (role.id,))
+
+        query = statements['set-role']
+        cursor.execute(query, (role.id, member.id))
+
+@threaded
+def delete_role(role, db_path):
+    """Forget a deleted custom role and unassign it from its member."""
+    with db(db_path) as cursor:
+        query = statements['exists-role']
+        role_is_relevant = cursor.execute(query, (role.id,)).fetchone()
+        if role_is_relevant[0] != 0:
+            query = statements['delete-role']
+            cursor.execute(query, (role.id,))
+
+            query = statements['null-role']
+            cursor.execute(query, (role.id,))
+
+@threaded
 def add_reminder(title, member, time, db_path):
-    """Add a new reminder to the database."""
+    """Add a new reminder to the database and return its ID."""
     member = member.id
     time = int(time.timestamp())
 
     with db(db_path) as cursor:
-        query = common.read_file('queries/add-reminder.sql')
+        query = statements['add-reminder']
         cursor.execute(query, (title, member, time))
+        return cursor.lastrowid
 
+@threaded
 def get_reminders(limit_time, db_path):
     """Get all the reminders before a specified time."""
     limit_time = int(limit_time.timestamp())
 
     with db(db_path) as cursor:
-        query = common.read_file('queries/select-reminders.sql')
+        query = statements['select-reminders']
         cursor.execute(query, (limit_time,))
         return cursor.fetchall()
 
+@threaded
+def get_pending_reminders(db_path):
+    """Get every stored reminder, earliest first."""
+    with db(db_path) as cursor:
+        query = statements['select-pending-reminders']
+        cursor.execute(query)
+        return cursor.fetchall()
+
+@threaded
 def delete_reminders(limit_time, db_path):
     """Delete reminders before a specified time."""
+    limit_time = int(limit_time.timestamp())
+
     with db(db_path) as cursor:
-        query = common.read_file('queries/delete-reminders.sql')
+        query = statements['delete-reminders']
         cursor.execute(query, (limit_time,))
 
+@threaded
+def delete_reminder(id, db_path):
+    """Delete a single reminder."""
+    with db(db_path) as cursor:
+        query = statements['delete-reminder']
+        cursor.execute(query, (id,))
+
+@threaded
 def get_birthdays(date, db_path):
     """Get all the birthdays for a certain day."""
-    date = date.strftime('%Y-%m-%d')
+    month_day = date.strftime('%m-%d')
+
+    # The list only changes when a birthday is set, so it is kept for the rest of the day
+    cached = birthday_cache.get(db_path)
+    if cached and cached[0] == month_day:
+        return cached[1]
 
     with db(db_path) as cursor:
-        query = common.read_file('queries/select-birthdays.sql')
-        cursor.execute(query, (date,))
-        return cursor.fetchall()
+        query = statements['select-birthdays']
+        cursor.execute(query, (month_day,))
+        birthdays = cursor.fetchall()
 
+    birthday_cache[db_path] = (month_day, birthdays)
+    return birthdays
+
+@threaded
 def add_birthday(member, date, db_path):
     """Add or change a member's recorded birthday."""
+    month_day = date.strftime('%m-%d')
     date = date.strftime('%Y-%m-%d')
 
     with db(db_path) as cursor:
-        query = common.read_file('queries/exists-birthday.sql')
+        query = statements['exists-birthday']
         exists = cursor.execute(query, (member.id,)).fetchone()[0]
 
         if exists == 0:
-            query = common.read_file('queries/add-birthday.sql')
-            cursor.execute(query, (member.id, date))
+            query = statements['add-birthday']
+            cursor.execute(query, (member.id, date, month_day))
         else:
-            query = common.read_file('queries/update-birthday.sql')
-            cursor.execute(query, (date, member.id))
\ No newline at end of file
+            query = statements['update-birthday']
+            cursor.execute(query, (date, month_day, member.id))
+
+    birthday_cache.pop(db_path, None)
+
+@threaded
+def get_cached_tracks(key, ttl, db_path):
+    """Get cached track metadata for a lookup, or None if it is missing or older than `ttl` seconds."""
+    now = int(time.time())
+
+    with db(db_path) as cursor:
+        query = statements['select-track-cache']
+        row = cursor.execute(query, (key, now - ttl)).fetchone()
+        if row is None:
+            return None
+
+        query = statements['touch-track-cache']
+        cursor.execute(query, (now, key))
+        return json.loads(row[0])
+
+@threaded
+def cache_tracks(key, tracks, ttl, size, db_path):
+    """Cache track metadata for a lookup, keeping at most `size` of the most recently used entries."""
+    now = int(time.time())
+
+    with db(db_path) as cursor:
+        query = statements['add-track-cache']
+        cursor.execute(query, (key, json.dumps(tracks), now, now))
+
+        query = statements['expire-track-cache']
+        cursor.execute(query, (now - ttl,))
+
+        query = statements['evict-track-cache']
+        cursor.execute(query, (size,))
@@ -0,0 +1,123 @@
+import os
+import threading
+from itertools import zip_longest
+
+from yt_dlp import YoutubeDL
+from yt_dlp.utils import DownloadCancelled
+
+class Downloads():
+    """Background song downloads shared by every guild's player, under one concurrency cap."""
+    def __init__(self, bot, audio_cache, youtube_dl_options, concurrency):
+        self.bot = bot
+        self.audio_cache = audio_cache
+        self.youtube_dl_options = youtube_dl_options
+        self.concurrency = concurrency
+        self.downloads = {}
+        # The songs each player wants downloaded, most urgent first
+        self.wanted = {}
+
+    def __contains__(self, song_id):
+        return song_id in self.downloads
+
+    def get(self, song_id):
+        return self.downloads.get(song_id)
+
+    def want(self, owner, songs):
+        """Replace the songs a player wants downloaded ahead of time."""
+        self.wanted[owner] = list(songs)
+        self.schedule()
+
+    def release(self, owner):
+        """Forget a player's wanted songs, cancelling downloads nobody else needs."""
+        self.wanted.pop(owner, None)
+        self.schedule()
+
+    def schedule(self):
+        """Cancel downloads nobody wants and start wanted ones up to the concurrency cap."""
+        wanted = {song.id for songs in self.wanted.values() for song in songs}
+        for song_id, download in self.downloads.items():
+            if song_id not in wanted:
+                download['cancelled'].set()
+
+        running = sum(1 for download in self.downloads.values() if not download['cancelled'].is_set())
+
+        # Take turns between players so one long queue can't hold every slot
+        for songs in zip_longest(*self.wanted.values()):
+            for song in songs:
+                if running >= self.concurrency:
+                    return
+                if song is None or song.id in self.downloads or song.id in self.audio_cache:
+                    continue
+
+                self.fetch(song)
+                running += 1
+
+    def fetch(self, song):
+        """Start downloading a song in the background, regardless of the cap."""
+        loop = self.bot.loop
+        download = {
+            'ready': loop.create_future(),
+            'cancelled': threading.Event(),
+        }
+        download['done'] = loop.run_in_executor(
+            None, self.__download, song, loop, download['ready'], download['cancelled']
+        )
+        download['done'].add_done_callback(lambda _: self.__fetched(song.id, download))
+
+        self.downloads[song.id] = download
+        return download
+
+    def path(self, song_id):
+        """Get the file a song can be played from, whether or not it has finished downloading."""
+        if os.path.exists(self.audio_cache.file(song_id)):
+            return self.audio_cache.file(song_id)
+        return self.audio_cache.partial(song_id)
+
+    def stream_url(self, url):
+        """Resolve the URL of a song's audio stream."""
+        with YoutubeDL(self.youtube_dl_options) as ydl:
+            return ydl.extract_info(url, download=False)['url']
+
+    def __download(self, song, loop, ready, cancelled):
+        """Download a song, resolving `ready` as soon as its file starts being written.
+
+        Songs from playlists are queued with only a few details, so the full ones
+        from the download are filled in too.
+        """
+        def signal(error=None):
+            if ready.done():
+                return
+            if error:
+                ready.set_exception(error)
+            else:
+                ready.set_result(None)
+
+        def hook(progress):
+            if cancelled.is_set():
+                raise DownloadCancelled()
+            if progress['status'] in ('downloading', 'finished'):
+                loop.call_soon_threadsafe(signal)
+
+        options = dict(self.youtube_dl_options, progress_hooks=[hook])
+        try:
+            with YoutubeDL(options) as ydl:
+                info = ydl.extract_info(song.webpage_url)
+        except Exception as e:
+            # Don't leave a partial file behind to be resumed or mistaken for a finished one
+            if os.path.exists(self.audio_cache.partial(song.id)):
+                os.remove(self.audio_cache.partial(song.id))
+            loop.call_soon_threadsafe(signal, e)
+            return
+        loop.call_soon_threadsafe(song.update, info)
+        loop.call_soon_threadsafe(self.audio_cache.add, song.id)
+        loop.call_soon_threadsafe(signal)
+
+    def __fetched(self, song_id, download):
+        if self.downloads.get(song_id) is download:
+            del self.downloads[song_id]
+
+        # Nobody waits on cancelled or failed prefetches, so mark their errors as seen
+        if download['ready'].done():
+            download['ready'].exception()
+
+        self.schedule()
@@ -0,0 +1,89 @@
+import logging
+import os
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+ENCODE_CONCURRENCY = 1
+# Discord plays 48 kHz stereo Opus, so files in this format can be sent as they are
+ENCODE_OPTIONS = ['-vn', '-ar', '48000', '-ac', '2', '-c:a', 'libopus', '-b:a', '128k', '-f', 'ogg']
+
+class Encoder():
+    """Cached songs transcoded once per filter into Ogg/Opus, so replays skip transcoding."""
+    def __init__(self, bot, audio_cache, concurrency=ENCODE_CONCURRENCY):
+        self.bot = bot
+        self.audio_cache = audio_cache
+        self.executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='encoder')
+        self.encoding = set()
+
+        # The CPU seconds each file took to encode, which every replay of it saves.
+        # Files encoded in earlier sessions have no measured cost, so their
+        # replays are counted but left out of the savings.
+        self.costs = {}
+        self.replays = 0
+        self.measured = 0
+        self.saved = 0
+
+    def name(self, song_id, variant):
+        return f'{song_id}.{variant}.opus'
+
+    def lookup(self, song_id, variant):
+        """Get the path of an encoded song, or None if it hasn't been encoded."""
+        name = self.name(song_id, variant)
+        if name not in self.audio_cache:
+            return None
+
+        self.replays += 1
+        if name in self.costs:
+            self.measured += 1
+            self.saved += self.costs[name]
+            logging.info(f'Replaying {name} without transcoding saves {self.costs[name]:.1f} CPU seconds')
+        return self.audio_cache.lookup(name)
+
+    def encode(self, song_id, variant, audio_filter=None):
+        """Start encoding a downloaded song in the background, unless it already has been."""
+        name = self.name(song_id, variant)
+        if name in self.audio_cache or name in self.encoding or song_id not in self.audio_cache:
+            return
+
+        self.encoding.add(name)
+        self.audio_cache.pin(song_id)
+        encoded = self.bot.loop.run_in_executor(
+            self.executor, self.__encode, self.audio_cache.file(song_id), self.audio_cache.file(name),
+            self.audio_cache.partial(name), audio_filter
+        )
+        encoded.add_done_callback(lambda _: self.__encoded(song_id, name, encoded))
+
+    def __encode(self, source, destination, partial, audio_filter):
+        """Run ffmpeg and return the CPU seconds it used."""
+        command = ['ffmpeg', '-nostdin', '-loglevel', 'error', '-y', '-i', source]
+        if audio_filter:
+            command += ['-af', audio_filter]
+        # Write elsewhere first so a half-written file is never played
+        command += ENCODE_OPTIONS + [partial]
+
+        process = subprocess.Popen(command, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        # wait4 reports the resources of this one child, unlike getrusage(RUSAGE_CHILDREN)
+        _, status, usage = os.wait4(process.pid, 0)
+        process.returncode = os.waitstatus_to_exitcode(status)
+
+        if process.returncode != 0:
+            if os.path.exists(partial):
+                os.remove(partial)
+            raise subprocess.CalledProcessError(process.returncode, command)
+
+        os.replace(partial, destination)
+        return usage.ru_utime + usage.ru_stime
+
+    def __encoded(self, song_id, name, encoded):
+        self.encoding.discard(name)
+        self.audio_cache.unpin(song_id)
+
+        try:
+            cost = encoded.result()
+        except Exception as e:
+            logging.error(f'Failed to encode {name}: {e}')
+            return
+
+        self.costs[name] = cost
+        self.audio_cache.add(name)
+        logging.info(f'Encoded {name} in {cost:.1f} CPU seconds')
@@ -1,10 +1,13 @@
+import asyncio
 import functools
 import logging
+import time
 
 import common
+import notifications
 import discord
 
-async def handle_notifications(message, *, sometimes_role, always_role, channel_role, pings_channel):
+async def handle_notifications(message, subscribers, *, pings_channel):
     """Handler for notifications that the bot must deliver."""
     if not common.has_url(message.content):
         return
@@ -13,31 +16,34 @@ async def handle_notifications(message, *, sometimes_role, always_role, channel_
     embed.add_field(name='Host', value=message.author.name)
 
     guild = message.guild
-    channel_role = guild.get_role(channel_role)
-    always_role = guild.get_role(always_role)
-    sometimes_role = guild.get_role(sometimes_role)
     pings_channel = guild.get_channel(pings_channel)
-
-    for member in guild.members:
-        try:
-            if member.bot:
-                continue
-
-            if always_role in member.roles:
-                pass
-            elif sometimes_role in member.roles:
-                if member.status == discord.Status.offline:
-                    continue
-            else:
-                continue
-
-            # Send message via user's preferred method
-            if channel_role in member.roles:
-                await pings_channel.send(member.mention, embed=embed)
-            else:
-                await common.send_dm_embed(embed, member)
-        except Exception as e:
-            logging.error(e)
+    dm_ids, channel_ids = subscribers.recipients()
+
+    # Send message via each subscriber's preferred method
+    mentions = []
+    for id in channel_ids:
+        member = guild.get_member(id)
+        if member:
+            mentions.append(member.mention)
+
+    deliveries = []
+    for id in dm_ids:
+        member = guild.get_member(id)
+        if member:
+            deliveries.append(functools.partial(common.send_dm_embed, embed, member))
+
+    start = time.perf_counter()
+    pinged, messaged = await asyncio.gather(
+        notifications.ping_channel(pings_channel, mentions, embed),
+        notifications.fan_out(deliveries),
+    )
+    report = notifications.Report(
+        pinged.delivered + messaged.delivered,
+        pinged.failed + messaged.failed,
+        time.perf_counter() - start,
+    )
+    logging.info(f'Notified {report.delivered} members ({report.failed} failed) in {report.elapsed:.2f}s')
+    return report
 
 async def handle_suggestions(message):
     """Handler for messages sent in the suggestions channel."""
@@ -0,0 +1,78 @@
+import asyncio
+import threading
+from itertools import islice
+
+from yt_dlp import YoutubeDL
+
+# The only parts of yt-dlp's info dictionary the cog uses
+TRACK_FIELDS = ['id', 'title', 'webpage_url', 'duration']
+
+def compact(info):
+    """Strip a yt-dlp info dictionary down to the fields the cog uses."""
+    track = {field: info.get(field) for field in TRACK_FIELDS}
+    # Flat playlist entries and search results only link to their page
+    track['webpage_url'] = track['webpage_url'] or info.get('url')
+    return track
+
+class Listing():
+    """The tracks a link or search stands for, listed on a worker thread and handed over a page at a time."""
+    def __init__(self, bot, youtube_dl_options, query, page_size, skip=0):
+        self.bot = bot
+        self.page_size = page_size
+        self.pages = asyncio.Queue()
+        self.stopped = threading.Event()
+
+        # Playlist entries are only listed here; the rest of their details come with their download
+        options = dict(youtube_dl_options, extract_flat='in_playlist')
+        bot.loop.run_in_executor(None, self.__list, options, query, skip)
+
+    async def next(self):
+        """Get the next page, whose `more` says whether another one follows it."""
+        page = await self.pages.get()
+        if isinstance(page, Exception):
+            raise page
+        return page
+
+    def stop(self):
+        """Stop listing once the page being read has been handed over."""
+        self.stopped.set()
+
+    def __hand_over(self, page):
+        self.bot.loop.call_soon_threadsafe(self.pages.put_nowait, page)
+
+    def __list(self, options, query, skip):
+        try:
+            with YoutubeDL(options) as ydl:
+                # Left unprocessed, a playlist's entries are read lazily as they are needed,
+                # so each of its pages is only requested once however long it is
+                info = ydl.extract_info(query, download=False, process=False)
+                if info.get('_type') != 'playlist':
+                    info = ydl.process_ie_result(info, download=False)
+
+                if query.startswith('ytsearch1:'):
+                    info = next(iter(info['entries']), None)
+                    if info is None:
+                        raise LookupError(f'No results for {query}')
+
+                summary = {'title': info.get('title'), 'webpage_url': compact(info)['webpage_url'] or query}
+                if info.get('_type') != 'playlist':
+                    self.__hand_over(dict(summary, tracks=[compact(info)], more=False))
+                    return
+
+                entries = iter(info.get('entries') or [])
+                for _ in islice(entries, skip):
+                    pass
+
+                # Unavailable entries are listed as None, so whether more follow
+                # is decided by what is left rather than by how many tracks a page kept
+                following = []
+                while not self.stopped.is_set():
+                    page = following + list(islice(entries, self.page_size - len(following)))
+                    following = list(islice(entries, 1))
+
+                    tracks = [compact(entry) for entry in page if entry]
+                    self.__hand_over(dict(summary, tracks=tracks, more=bool(following)))
+                    if not following:
+                        return
+        except Exception as e:
+            self.__hand_over(e)
@@ -1,42 +1,89 @@
 import common
+import database
+from audiocache import AudioCache
+from downloads import Downloads
+from encoder import Encoder
+from listing import Listing
+from player import Player
 
 import asyncio
-import os
-import random
 import logging
-from multiprocessing import Process
+from urllib.parse import urlsplit, urlunsplit
 
 import discord
 from discord.ext import commands
-from yt_dlp import YoutubeDL
 
 logging.basicConfig(filename='log.txt', level=logging.INFO)
 
-class Music(commands.Cog):
-    download_process = None
+# Seconds to wait for yt-dlp to look up a song or playlist
+RESOLVE_TIMEOUT = 60
+# Lookups are cached for a week, keeping the most recently used ones
+METADATA_TTL = 7 * 24 * 60 * 60
+METADATA_CACHE_SIZE = 10000
+# Megabytes of downloaded audio to keep around for replays
+AUDIO_CACHE_SIZE = 1024
+# How many upcoming songs to download ahead, and how many downloads may run at once
+PREFETCH = 2
+DOWNLOAD_CONCURRENCY = 2
+# Play songs that aren't cached straight from their stream URL while they download
+STREAMING = True
+# Keep songs pre-encoded as Opus for each filter, trading disk space for CPU on replays
+ENCODE = False
+# Playlists are looked up this many entries at a time, the first page playing while the rest load
+PLAYLIST_PAGE = 100
+# Discord allows at most 25 fields in an embed
+QUEUE_FIELDS = 25
+
+def cache_key(link):
+    """Normalise a link or search so equivalent requests share a cache entry."""
+    if not common.has_url(link):
+        return 'search:' + ' '.join(link.lower().split())
+
+    url = urlsplit(link.strip())
+    return 'url:' + urlunsplit((url.scheme.lower(), url.netloc.lower(), url.path, url.query, ''))
 
+class Music(commands.Cog):
     def __init__(self, bot, settings):
         self.bot = bot
         self.settings = settings
         self.path = settings['paths']['music']
-
-        self.refresh()
-
-        self.ffmpeg_options = {
-            'before_options': '',
-            'options': '-reconnect_streamed 1 -reconnect_delay_max 5 -vn',
-        }
-        self.youtube_dl_options = {'format': 'bestaudio', 'outtmpl': f'{self.path}/%(id)s', 'nopart': True, 'quiet': True}
-
-    def refresh(self):
-        self.queue = []
-        self.loop = False
-        self.loop_queue = False
-        self.shuffle = False
-        self.skipping = False
-        self.nightcore = False
-        self.vaporwave = False
-        self.bass_boosted = False
+        self.players = {}
+        self.db_path = settings['paths']['database']
+
+        music_settings = settings.get('music', {})
+        self.resolve_timeout = music_settings.get('resolve_timeout', RESOLVE_TIMEOUT)
+        self.metadata_ttl = music_settings.get('metadata_ttl', METADATA_TTL)
+        self.metadata_cache_size = music_settings.get('metadata_cache_size', METADATA_CACHE_SIZE)
+
+        audio_cache_size = music_settings.get('audio_cache_size', AUDIO_CACHE_SIZE)
+        self.audio_cache = AudioCache(self.path, audio_cache_size * 1024 * 1024)
+        self.prefetch = music_settings.get('prefetch', PREFETCH)
+        self.streaming = music_settings.get('streaming', STREAMING)
+        self.playlist_page = music_settings.get('playlist_page', PLAYLIST_PAGE)
+
+        # yt-dlp writes to a .part file and renames it when done, so only finished songs are cached
+        self.youtube_dl_options = {'format': 'bestaudio', 'outtmpl': f'{self.path}/%(id)s', 'quiet': True}
+
+        # Downloads and the audio cache are shared by every guild's player
+        download_concurrency = music_settings.get('download_concurrency', DOWNLOAD_CONCURRENCY)
+        self.downloads = Downloads(bot, self.audio_cache, self.youtube_dl_options, download_concurrency)
+        self.encoder = Encoder(bot, self.audio_cache) if music_settings.get('encode', ENCODE) else None
+
+    def __player(self, guild):
+        """Get a guild's player, creating it the first time it's needed."""
+        if guild.id not in self.players:
+            self.players[guild.id] = Player(
+                self.bot,
+                self.downloads,
+                prefetch=self.prefetch,
+                streaming=self.streaming,
+                resolve_timeout=self.resolve_timeout,
+                encoder=self.encoder,
+            )
+
+        player = self.players[guild.id]
+        player.client = guild.voice_client
+        return player
 
     @commands.command(aliases=['connect', 'c'])
     async def join(self, ctx):
@@ -52,42 +99,32 @@ class Music(commands.Cog):
     async def leave(self, ctx):
         """Disconnects from a voice channel."""
         client = ctx.message.guild.voice_client
-        if client.is_connected():
+        if client and client.is_connected():
             await client.disconnect()
-            self.refresh()
             await ctx.send(embed=common.create_embed({'title': 'Disconnected'}))
         else:
             await ctx.send('What do you want me to leave?')
 
-        self.__clear()
+        player = self.players.pop(ctx.message.guild.id, None)
+        if player:
+            player.close()
 
     @commands.command(aliases=['p'])
     async def play(self, ctx, *link):
         """Adds a specified song to the queue."""
         link = ' '.join(link)
-        client = ctx.message.guild.voice_client
-
-        queue = self.queue
-
-        def next(error):
-            if not client or not client.is_connected():
-                return
-
-            if self.loop:
-                audio = self.__play()
-                client.play(audio, after=next)
-            else:
-                if self.skipping:
-                    self.skipping = False
-                else:
-                    self.__dequeue()
-
-                if len(queue) > 0:
-                    audio = self.__play()
-                    client.play(audio, after=next)
+        player = self.__player(ctx.message.guild)
 
         async with ctx.channel.typing():
-            song = await self.__enqueue(link)
+            try:
+                song = await player.enqueue(self.__lookup(link))
+            except asyncio.TimeoutError:
+                await ctx.send('That took too long to look up')
+                return
+            except Exception as e:
+                logging.error(f'Failed to look up {link}: {e}')
+                await ctx.send("I couldn't find that")
+                return
 
         embed = common.create_embed({
             'title': 'Added to queue',
@@ -95,9 +132,16 @@ class Music(commands.Cog):
         })
         await ctx.send(embed=embed)
 
-        if not client.is_playing():
-            audio = self.__play()
-            client.play(audio, after=next)
+        # The rest of a playlist loads in the background, carrying on from its first page's listing
+        if song['more']:
+            listings = [song['listing']] if 'listing' in song else []
+            task = self.bot.loop.create_task(self.__expand(player, link, listings))
+            # Stop listing even if the expansion is cancelled before it starts
+            task.add_done_callback(lambda _: [listing.stop() for listing in listings])
+            player.expansions.add(task)
+            task.add_done_callback(player.expansions.discard)
+
+        await player.play()
 
     @commands.command()
     async def pause(self, ctx):
@@ -128,63 +172,66 @@ class Music(commands.Cog):
     @commands.command(aliases=['q'])
     async def queue(self, ctx):
         """Shows a list of queued songs."""
-        queue = self.queue
+        player = self.__player(ctx.message.guild)
         embed = discord.Embed(title='Queue', description='')
 
-        if self.nightcore or self.bass_boosted or self.vaporwave:
-            if self.nightcore:
+        if player.nightcore or player.bass_boosted or player.vaporwave:
+            if player.nightcore:
                 embed.description += '\n📻 Nightcore'
-            elif self.vaporwave:
+            elif player.vaporwave:
                 embed.description += '\n📻 Vaporwave'
-            elif self.bass_boosted:
+            elif player.bass_boosted:
                 embed.description += '\n📻 Bass boosted'
 
-        if self.loop or self.loop_queue or self.shuffle:
-            if self.shuffle:
+        if player.loop or player.loop_queue or player.shuffle:
+            if player.shuffle:
                 embed.description += '\n🔀 Shuffling queue'
-            elif self.loop:
+            elif player.loop:
                 embed.description += '\n🔂 Looping track'
-            elif self.loop_queue:
+            elif player.loop_queue:
                 embed.description += '\n🔁 Looping queue'
 
-        names = ['Now playing'] + list(range(1, len(queue)))
-        for song, name in zip(queue, names):
-            embed.add_field(name=name, value=f'[{song["title"]}]({song["webpage_url"]})', inline=False)
+        names = ['Now playing'] + list(range(1, min(len(player.queue), QUEUE_FIELDS)))
+        for song, name in zip(player.queue, names):
+            embed.add_field(name=name, value=f'[{song.title}]({song.webpage_url})', inline=False)
 
         await ctx.send(embed=embed)
 
     @commands.command(aliases=['nowplaying', 'np'])
     async def now_playing(self, ctx):
         """Shows the current track."""
-        song = self.queue[0]
-        embed = common.create_embed({'title': 'Now playing', 'description': f'[{song["title"]}]({song["webpage_url"]})'})
+        player = self.__player(ctx.message.guild)
+        song = player.queue[0]
+        embed = common.create_embed({'title': 'Now playing', 'description': f'[{song.title}]({song.webpage_url})'})
         await ctx.send(embed=embed)
 
     @commands.command(aliases=['l'])
     async def loop(self, ctx):
         """Loops the current track."""
+        player = self.__player(ctx.message.guild)
         async with ctx.channel.typing():
-            self.loop = not self.loop
-            self.loop_queue = False
-            self.shuffle = False
+            player.loop = not player.loop
+            player.loop_queue = False
+            player.shuffle = False
 
-        song = self.queue[0]
-        status = 'Looping' if self.loop else 'Stopped looping'
+        song = player.queue[0]
+        status = 'Looping' if player.loop else 'Stopped looping'
         embed = common.create_embed({
             'title': 'Queue',
-            'description': f'{status} [{song["title"]}]({song["webpage_url"]})'
+            'description': f'{status} [{song.title}]({song.webpage_url})'
         })
         await ctx.send(embed=embed)
 
     @commands.command(aliases=['loopqueue', 'loopq', 'lq'])
     async def loop_queue(self, ctx):
         """Loops the queued songs."""
+        player = self.__player(ctx.message.guild)
         async with ctx.channel.typing():
-            self.loop_queue = not self.loop_queue
-            self.loop = False
-            self.shuffle = False
+            player.loop_queue = not player.loop_queue
+            player.loop = False
+            player.shuffle = False
 
-        status = 'Looping' if self.loop_queue else 'Stopped looping'
+        status = 'Looping' if player.loop_queue else 'Stopped looping'
         embed = common.create_embed({
             'title': 'Queue',
             'description': f'{status} queue'
@@ -194,11 +241,14 @@ class Music(commands.Cog):
     @commands.command()
     async def shuffle(self, ctx):
         """Plays the queued songs in order."""
-        self.shuffle = not self.shuffle
-        self.loop = False
-        self.loop_queue = False
-
-        status = 'Shuffling' if self.shuffle else 'Stopped shuffling'
+        player = self.__player(ctx.message.guild)
+        player.shuffle = not player.shuffle
+        player.shuffle_next = []
+        player.loop = False
+        player.loop_queue = False
+        player.prefetch()
+
+        status = 'Shuffling' if player.shuffle else 'Stopped shuffling'
         embed = common.create_embed({
             'title': 'Queue',
             'description': f'{status} queue',
@@ -208,11 +258,12 @@ class Music(commands.Cog):
     @commands.command(aliases=['nc', 'weeb'])
     async def nightcore(self, ctx):
         """Enables nightcore mode."""
-        self.nightcore = not self.nightcore
-        self.vaporwave = False
-        self.bass_boosted = False
+        player = self.__player(ctx.message.guild)
+        player.nightcore = not player.nightcore
+        player.vaporwave = False
+        player.bass_boosted = False
 
-        status = 'ON' if self.nightcore else 'OFF'
+        status = 'ON' if player.nightcore else 'OFF'
         embed = common.create_embed({
             'title': 'Queue',
             'description': f'Nightcore {status}',
@@ -222,11 +273,12 @@ class Music(commands.Cog):
     @commands.command(aliases=['vp', 'vapor'])
     async def vaporwave(self, ctx):
         """Enables vaporwave mode."""
-        self.vaporwave = not self.vaporwave
-        self.nightcore = False
-        self.bass_boosted = False
+        player = self.__player(ctx.message.guild)
+        player.vaporwave = not player.vaporwave
+        player.nightcore = False
+        player.bass_boosted = False
 
-        status = 'ON' if self.vaporwave else 'OFF'
+        status = 'ON' if player.vaporwave else 'OFF'
         embed = common.create_embed({
             'title': 'Queue',
             'description': f'Vaporwave {status}',
@@ -236,11 +288,12 @@ class Music(commands.Cog):
     @commands.command(aliases=['bassboost', 'bass_boosted', 'bassboosted', 'bass'])
     async def bass_boost(self, ctx):
         """Enabled bass-boosted mode."""
-        self.bass_boosted = not self.bass_boosted
-        self.vaporwave = False
-        self.nightcore = False
+        player = self.__player(ctx.message.guild)
+        player.bass_boosted = not player.bass_boosted
+        player.vaporwave = False
+        player.nightcore = False
 
-        status = 'ON' if self.bass_boosted else 'OFF'
+        status = 'ON' if player.bass_boosted else 'OFF'
         embed = common.create_embed({
             'title': 'Queue',
             'description': f'Bass boost {status}',
@@ -250,59 +303,65 @@ class Music(commands.Cog):
     @commands.command(aliases=['s'])
     async def skip(self, ctx):
         """Skips the current song."""
-        song = self.queue[0]
-        self.skipping = True
+        player = self.__player(ctx.message.guild)
+        song = player.queue[0]
+        player.skipping = True
 
         async with ctx.channel.typing():
             client = ctx.message.guild.voice_client
-            self.__dequeue()
+            player.dequeue()
             client.stop()
 
         embed = common.create_embed({
             'title': 'Queue',
-            'description': f'Skipped [{song["title"]}]({song["webpage_url"]})'
+            'description': f'Skipped [{song.title}]({song.webpage_url})'
         })
         await ctx.send(embed=embed)
 
     @commands.command(aliases=['j'])
     async def jump(self, ctx, number):
         """Skips straight to a specified song."""
-        self.skipping = True
+        player = self.__player(ctx.message.guild)
+        player.skipping = True
 
         async with ctx.channel.typing():
             client = ctx.message.guild.voice_client
             for skip in range(int(number)):
-                self.__dequeue()
+                player.dequeue()
             client.stop()
 
-        song = self.queue[0]
+        song = player.queue[0]
         embed = common.create_embed({
             'title': 'Queue',
-            'description': f'Skipped to [{song["title"]}]({song["webpage_url"]})'
+            'description': f'Skipped to [{song.title}]({song.webpage_url})'
         })
         await ctx.send(embed=embed)
 
     @commands.command(aliases=['rm', 'x'])
     async def remove(self, ctx, number):
         """Removes a specified song from the queue."""
-        if int(number) >= len(self.queue):
+        player = self.__player(ctx.message.guild)
+        if int(number) >= len(player.queue):
             return
 
-        song = self.queue.pop(int(number))
+        song = player.queue[int(number)]
+        del player.queue[int(number)]
+        player.prefetch()
 
         embed = common.create_embed({
             'title': 'Queue',
-            'description': f'Removed [{song["title"]}]({song["webpage_url"]})'
+            'description': f'Removed [{song.title}]({song.webpage_url})'
         })
         await ctx.send(embed=embed)
 
     @commands.command()
     async def clear(self, ctx):
         """Removes all songs from the queue."""
+        player = self.__player(ctx.message.guild)
         async with ctx.channel.typing():
             client = ctx.message.guild.voice_client
             client.stop()
-            self.__clear()
+            player.clear()
 
         embed = common.create_embed({
             'title': 'Queue',
@@ -310,69 +369,83 @@ class Music(commands.Cog):
         })
         await ctx.send(embed=embed)
 
-    def __download(self, url):
-        with YoutubeDL(self.youtube_dl_options) as ydl:
-            ydl.download([url])
-
-    async def __enqueue(self, link):
-        with YoutubeDL(self.youtube_dl_options) as ydl:
-            if common.has_url(link):
-                info = ydl.extract_info(link, download=False)
-
-                if 'entries' in info:
-                    for track in info['entries']:
-                        self.queue.append(track)
-                else:
-                    self.queue.append(info)
-            else:
-                info = ydl.extract_info(f'ytsearch1:{link}', download=False)['entries'][0]
-                self.queue.append(info)
-
-        return info
-        
-    def __dequeue(self):
-        if len(self.queue) == 0:
-            return
-
-        if self.loop:
-            return
-        elif self.loop_queue:
-            song = self.queue.pop(0)
-            self.queue.append(song)
-        elif self.shuffle:
-            index = random.randrange(len(self.queue) - 1)
-            song = self.queue.pop(index)
-            self.queue.insert(0, song)
+    @commands.command()
+    async def cache(self, ctx):
+        """Shows how much downloading the music cache has saved."""
+        megabyte = 1024 * 1024
+        fields = {
+            'title': 'Music cache',
+            'Hits': self.audio_cache.hits,
+            'Misses': self.audio_cache.misses,
+            'Size': f'{self.audio_cache.total / megabyte:.1f} / {self.audio_cache.size / megabyte:.0f} MB',
+        }
+        if self.encoder:
+            measured = self.encoder.measured
+            per_replay = self.encoder.saved / measured if measured else 0
+            fields['Replays without transcoding'] = self.encoder.replays
+            fields['CPU saved'] = f'{self.encoder.saved:.1f} s ({per_replay:.1f} s per measured replay)'
+
+        await ctx.send(embed=common.create_embed(fields))
+
+    async def __lookup(self, link):
+        """Get the first page of the tracks a link or search stands for, from the cache when possible.
+
+        A playlist that is looked up goes on being listed, and its listing is
+        handed on under `listing` for the rest of its pages.
+        """
+        key = cache_key(link)
+        result = await database.get_cached_tracks(key, self.metadata_ttl, self.db_path)
+        # Searches used to be cached without a link, and pages without saying if more follow
+        if result and result['webpage_url'] and 'more' in result:
+            return result
+
+        if common.has_url(link):
+            query = link
         else:
-            song = self.queue.pop(0)
-    
-    def __play(self):
-        if len(self.queue) == 0:
-            return
-
-        current_song = self.queue[0]
-        song_path = os.path.join(self.path, current_song["id"])
-        options = self.ffmpeg_options.copy()
-
-        if self.nightcore:
-            options['options'] += ' -af "asetrate=44100*4/3"'
-        elif self.vaporwave:
-            options['options'] += ' -af "asetrate=44100*3/4"'
-        elif self.bass_boosted:
-            options['options'] += ' -af "bass=g=12"'
-
-        if self.download_process:
-            self.download_process.join()
-        self.download_process = Process(target=self.__download, args=(current_song['webpage_url'],))
-        self.download_process.start()
-
-        song_path = os.path.join(self.path, current_song['id'])
-        while not os.path.exists(song_path):
-            continue
+            query = f'ytsearch1:{link}'
+        listing = Listing(self.bot, self.youtube_dl_options, query, self.playlist_page)
+        try:
+            result = await asyncio.wait_for(listing.next(), self.resolve_timeout)
+        except BaseException:
+            listing.stop()
+            raise
+
+        await database.cache_tracks(key, result, self.metadata_ttl, self.metadata_cache_size, self.db_path)
+        if result['more']:
+            result = dict(result, listing=listing)
+        return result
+
+    async def __page(self, link, page, listings):
+        """Get a later page of a playlist from the cache, or else from its listing."""
+        key = f'{cache_key(link)} page {page}'
+        if not listings:
+            result = await database.get_cached_tracks(key, self.metadata_ttl, self.db_path)
+            if result and 'more' in result:
+                return result
+
+            # Pick up where the cache left off, listing the playlist only once from there
+            skip = (page - 1) * self.playlist_page
+            listings.append(Listing(self.bot, self.youtube_dl_options, link, self.playlist_page, skip))
+
+        result = await asyncio.wait_for(listings[0].next(), self.resolve_timeout)
+        await database.cache_tracks(key, result, self.metadata_ttl, self.metadata_cache_size, self.db_path)
+        return result
+
+    async def __expand(self, player, link, listings):
+        """Queue the rest of a playlist a page at a time while its first page plays."""
+        page = 2
+        while True:
+            try:
+                info = await player.enqueue(self.__page(link, page, listings))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.error(f'Failed to load page {page} of {link}: {e}')
+                return
 
-        return discord.FFmpegOpusAudio(song_path, **options)
+            # Don't let clearing the queue interrupt a song that is starting
+            await asyncio.shield(player.play())
 
-    def __clear(self):
-        self.queue = []
-        for file in os.listdir(self.path):
-            os.remove(f'{self.path}/{file}')
\ No newline at end of file
+            if not info['more']:
+                return
+            page += 1
@@ -0,0 +1,147 @@
+import asyncio
+import functools
+import logging
+import time
+from collections import namedtuple
+
+import discord
+
+FAN_OUT_CONCURRENCY = 10
+FAN_OUT_RETRIES = 3
+FAN_OUT_BACKOFF = 1
+
+# Discord's limit on the length of a message's content
+MESSAGE_LIMIT = 2000
+
+Report = namedtuple('Report', ['delivered', 'failed', 'elapsed'])
+
+class Subscribers():
+    """An index of the members who want game notifications, split by how they get them."""
+    def __init__(self, *, sometimes_role, always_role, channel_role):
+        self.sometimes_role = sometimes_role
+        self.always_role = always_role
+        self.channel_role = channel_role
+
+        self.always = set()
+        self.sometimes = set()
+        self.online = set()
+        self.channel = set()
+
+    def build(self, members):
+        """Rebuild the index from scratch."""
+        for index in (self.always, self.sometimes, self.online, self.channel):
+            index.clear()
+
+        for member in members:
+            self.update(member)
+
+    def update(self, member):
+        """Re-index a member after their roles or status may have changed."""
+        self.remove(member)
+        if member.bot:
+            return
+
+        role_ids = {role.id for role in member.roles}
+        if self.always_role in role_ids:
+            self.always.add(member.id)
+        elif self.sometimes_role in role_ids:
+            self.sometimes.add(member.id)
+        else:
+            return
+
+        if self.channel_role in role_ids:
+            self.channel.add(member.id)
+        if member.status != discord.Status.offline:
+            self.online.add(member.id)
+
+    def remove(self, member):
+        """Drop a member from the index."""
+        for index in (self.always, self.sometimes, self.online, self.channel):
+            index.discard(member.id)
+
+    def recipients(self):
+        """Get the IDs of the members to notify by DM and in the pings channel."""
+        subscribed = self.always | (self.sometimes & self.online)
+        return subscribed - self.channel, subscribed & self.channel
+
+def is_transient(error):
+    """Check whether a failed delivery is worth retrying."""
+    if isinstance(error, (discord.Forbidden, discord.NotFound)):
+        return False
+    if isinstance(error, discord.HTTPException):
+        return error.status >= 500 or error.status == 429
+    return isinstance(error, (asyncio.TimeoutError, OSError))
+
+async def deliver(delivery, *, retries=FAN_OUT_RETRIES, backoff=FAN_OUT_BACKOFF, semaphore=None):
+    """Await a coroutine function, retrying transient failures with exponential backoff.
+
+    Returns whether the delivery eventually succeeded.
+    """
+    for attempt in range(retries + 1):
+        try:
+            if semaphore:
+                async with semaphore:
+                    await delivery()
+            else:
+                await delivery()
+            return True
+        except Exception as e:
+            if attempt == retries or not is_transient(e):
+                logging.error(e)
+                return False
+        await asyncio.sleep(backoff * 2 ** attempt)
+
+async def fan_out(deliveries, *, concurrency=FAN_OUT_CONCURRENCY, retries=FAN_OUT_RETRIES, backoff=FAN_OUT_BACKOFF):
+    """Await coroutine functions concurrently, retrying transient failures.
+
+    discord.py already queues requests behind each route's rate limit bucket,
+    so the concurrency cap only has to keep the bot clear of the global limit.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    start = time.perf_counter()
+
+    results = await asyncio.gather(*(
+        deliver(delivery, retries=retries, backoff=backoff, semaphore=semaphore)
+        for delivery in deliveries
+    ))
+    delivered = sum(results)
+    return Report(delivered, len(results) - delivered, time.perf_counter() - start)
+
+def pack_mentions(mentions, limit=MESSAGE_LIMIT):
+    """Join mentions into as few messages as fit within Discord's length limit."""
+    messages = []
+    current = []
+    length = 0
+
+    for mention in mentions:
+        if current and length + 1 + len(mention) > limit:
+            messages.append(current)
+            current = []
+            length = 0
+
+        length += len(mention) + (1 if current else 0)
+        current.append(mention)
+
+    if current:
+        messages.append(current)
+    return messages
+
+async def ping_channel(channel, mentions, embed, *, retries=FAN_OUT_RETRIES, backoff=FAN_OUT_BACKOFF):
+    """Ping members in a channel with as few messages as possible, sent in order with the embed on the first."""
+    start = time.perf_counter()
+    delivered = 0
+    failed = 0
+
+    for index, batch in enumerate(pack_mentions(mentions)):
+        content = ' '.join(batch)
+        if index == 0:
+            send = functools.partial(channel.send, content, embed=embed)
+        else:
+            send = functools.partial(channel.send, content)
+
+        if await deliver(send, retries=retries, backoff=backoff):
+            delivered += len(batch)
+        else:
+            failed += len(batch)
+
+    return Report(delivered, failed, time.perf_counter() - start)
@@ -0,0 +1,362 @@
+import common
+
+import asyncio
+import random
+import logging
+
+import discord
+
+# The ffmpeg audio filter behind each playback mode
+FILTERS = {
+    'nightcore': 'asetrate=44100*4/3',
+    'vaporwave': 'asetrate=44100*3/4',
+    'bass_boosted': 'bass=g=12',
+}
+
+class Track():
+    """The parts of a queued song the player needs, without a dictionary per song."""
+    __slots__ = ('id', 'title', 'webpage_url', 'duration')
+
+    def __init__(self, id, title, webpage_url, duration=None):
+        self.id = id
+        self.title = title
+        self.webpage_url = webpage_url
+        self.duration = duration
+
+    def update(self, info):
+        """Fill in details from a full yt-dlp info dictionary."""
+        for field in self.__slots__:
+            if info.get(field) is not None:
+                setattr(self, field, info[field])
+
+class TrackQueue():
+    """A list of tracks that can be popped from the front and indexed anywhere in constant time."""
+    def __init__(self):
+        self.tracks = []
+        # Tracks before this position have already been popped
+        self.start = 0
+
+    def __len__(self):
+        return len(self.tracks) - self.start
+
+    def __iter__(self):
+        return (self.tracks[index] for index in range(self.start, len(self.tracks)))
+
+    def __position(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('queue index out of range')
+        return self.start + index
+
+    def __getitem__(self, index):
+        return self.tracks[self.__position(index)]
+
+    def __setitem__(self, index, track):
+        self.tracks[self.__position(index)] = track
+
+    def __delitem__(self, index):
+        del self.tracks[self.__position(index)]
+
+    def append(self, track):
+        self.tracks.append(track)
+
+    def extend(self, tracks):
+        self.tracks.extend(tracks)
+
+    def popleft(self):
+        track = self[0]
+        self.tracks[self.start] = None
+        self.start += 1
+
+        # Drop the popped slots once they make up half the list, which keeps pops amortised O(1)
+        if self.start * 2 >= len(self.tracks):
+            del self.tracks[:self.start]
+            self.start = 0
+        return track
+
+    def rotate(self):
+        """Move the front track to the back."""
+        self.append(self.popleft())
+
+    def clear(self):
+        self.tracks = []
+        self.start = 0
+
+class Player():
+    """One guild's voice session: its queue, playback modes, voice client and prefetching."""
+    def __init__(self, bot, downloads, *, prefetch, streaming, resolve_timeout, encoder=None):
+        self.bot = bot
+        self.downloads = downloads
+        self.encoder = encoder
+        self.audio_cache = downloads.audio_cache
+        self.prefetch_count = prefetch
+        self.streaming = streaming
+        self.resolve_timeout = resolve_timeout
+
+        self.client = None
+        # The playing song is always at the front
+        self.queue = TrackQueue()
+        self.enqueued = None
+        # Background tasks still loading the rest of a playlist
+        self.expansions = set()
+        self.playing = None
+        self.pins = []
+
+        self.loop = False
+        self.loop_queue = False
+        self.shuffle = False
+        # Upcoming shuffled picks as (position, track) pairs
+        self.shuffle_next = []
+        self.skipping = False
+        self.active = False
+        # Set between one song ending and the next one starting, when the client isn't playing
+        self.starting = False
+        self.nightcore = False
+        self.vaporwave = False
+        self.bass_boosted = False
+
+        self.ffmpeg_options = {
+            'before_options': '',
+            'options': '-vn',
+        }
+        self.stream_options = '-reconnect 1 -reconnect_streamed 1 -reconnect_delay_max 5'
+
+    async def enqueue(self, lookup):
+        """Await a lookup and queue its tracks, keeping the order songs were requested in."""
+        # Lookups run concurrently, but songs join the queue in the order they were requested
+        previous = self.enqueued
+        enqueued = asyncio.get_running_loop().create_future()
+        self.enqueued = enqueued
+
+        try:
+            info = await lookup
+
+            if previous:
+                await asyncio.wait([previous])
+            self.queue.extend(Track(**track) for track in info['tracks'])
+        finally:
+            enqueued.set_result(None)
+
+        return info
+
+    def dequeue(self):
+        if len(self.queue) == 0:
+            return
+
+        if self.loop:
+            return
+        elif self.loop_queue:
+            self.queue.rotate()
+        elif self.shuffle:
+            upcoming = self.__upcoming(1)
+            if not upcoming:
+                return
+            index, song = self.shuffle_next.pop(0)
+
+            # Swap the pick with the song that just played, which stays queued for later
+            self.queue[0], self.queue[index] = song, self.queue[0]
+        else:
+            self.queue.popleft()
+
+    async def play(self):
+        """Start playing if nothing is, otherwise make sure newly queued songs get prefetched."""
+        # Don't trust `active` alone, in case the voice connection dropped mid-song
+        client = self.client
+        playing = client and (client.is_playing() or client.is_paused())
+        if self.active and (playing or self.starting):
+            self.prefetch()
+        else:
+            self.active = True
+            await self.start()
+
+    async def start(self):
+        """Start playing the song at the front of the queue."""
+        client = self.client
+        self.starting = True
+        try:
+            audio = await self.__play()
+            if not client or not client.is_connected():
+                self.active = False
+                return
+
+            if audio:
+                client.play(audio, after=lambda error: self.__after(client, error))
+                self.prefetch()
+            else:
+                # Drop a song that can't be downloaded rather than retrying it forever
+                if self.queue:
+                    self.queue.popleft()
+                await self.__next(client, dequeue=False)
+        finally:
+            self.starting = False
+
+    def prefetch(self):
+        """Tell the shared downloads which songs this player needs soon."""
+        wanted = self.__upcoming(self.prefetch_count)
+        if self.playing:
+            wanted.insert(0, self.playing)
+        self.downloads.want(self, wanted)
+
+    def clear(self):
+        for task in self.expansions:
+            task.cancel()
+        self.queue.clear()
+        self.shuffle_next = []
+        self.playing = None
+        self.__pin()
+        self.prefetch()
+
+    def close(self):
+        """Drop the queue and give up any downloads only this player needed."""
+        self.clear()
+        self.active = False
+        self.downloads.release(self)
+
+    def __upcoming(self, count):
+        """Predict the songs that will play after the current one."""
+        if len(self.queue) < 2 or self.loop or count <= 0:
+            return []
+
+        if self.loop_queue:
+            return [self.queue[index % len(self.queue)] for index in range(1, min(count, len(self.queue)) + 1)]
+
+        if self.shuffle:
+            # Shuffled picks are made ahead of time so they can be downloaded ahead of time.
+            # They are kept by position, and dropped if a removal has shifted another song there.
+            self.shuffle_next = [
+                (index, song) for index, song in self.shuffle_next
+                if 0 < index < len(self.queue) and self.queue[index] is song
+            ]
+
+            picked = {index for index, song in self.shuffle_next}
+            missing = min(count, len(self.queue) - 1) - len(self.shuffle_next)
+            while missing > 0:
+                index = random.randrange(1, len(self.queue))
+                if index not in picked:
+                    picked.add(index)
+                    self.shuffle_next.append((index, self.queue[index]))
+                    missing -= 1
+            return [song for index, song in self.shuffle_next[:count]]
+
+        return [self.queue[index] for index in range(1, min(count, len(self.queue) - 1) + 1)]
+
+    def __pin(self, *names):
+        """Keep the files the playing song is read from from being evicted, releasing the previous song's."""
+        for name in self.pins:
+            self.audio_cache.unpin(name)
+        self.pins = list(names)
+        for name in self.pins:
+            self.audio_cache.pin(name)
+
+    def __variant(self):
+        for variant in FILTERS:
+            if getattr(self, variant):
+                return variant
+        return 'plain'
+
+    def __encode(self, song, variant):
+        """Transcode a song for cheaper replays once its download has finished."""
+        if not self.encoder:
+            return
+
+        download = self.downloads.get(song.id)
+        if download:
+            download['done'].add_done_callback(lambda _: self.__encode(song, variant))
+        else:
+            self.encoder.encode(song.id, variant, FILTERS.get(variant))
+
+    def __after(self, client, error):
+        # Called from the voice thread once a song ends
+        if error:
+            logging.error(error)
+        self.starting = True
+        asyncio.run_coroutine_threadsafe(self.__next(client), self.bot.loop)
+
+    async def __next(self, client, dequeue=True):
+        self.starting = False
+        if not client or not client.is_connected():
+            self.active = False
+            return
+
+        if self.loop and dequeue:
+            await self.start()
+        else:
+            if self.skipping:
+                self.skipping = False
+            elif dequeue:
+                self.dequeue()
+
+            if len(self.queue) > 0:
+                await self.start()
+            else:
+                self.active = False
+
+    async def __stream(self, song, options):
+        """Get audio that plays a song straight from its stream while the cache fills in the background."""
+        # Filling the cache isn't urgent while the stream plays, so it waits for a slot under the cap.
+        # The playing song comes first in what this player wants, and a cancelled download of it
+        # is started again once it has wound down.
+        self.prefetch()
+
+        try:
+            stream_url = await asyncio.wait_for(
+                common.run_blocking(self.downloads.stream_url, self.bot, song.webpage_url), self.resolve_timeout
+            )
+        except Exception as e:
+            logging.error(f'Failed to stream {song.webpage_url}: {e}')
+            return
+
+        options = dict(options, before_options=f'{options["before_options"]} {self.stream_options}'.strip())
+        return discord.FFmpegOpusAudio(stream_url, **options)
+
+    async def __play(self):
+        if len(self.queue) == 0:
+            return
+
+        current_song = self.queue[0]
+        variant = self.__variant()
+        options = self.ffmpeg_options.copy()
+        if variant in FILTERS:
+            options['options'] += f' -af "{FILTERS[variant]}"'
+
+        self.playing = current_song
+        self.__pin(current_song.id)
+
+        # Already encoded as Opus, so ffmpeg only has to pass it through
+        # (discord.py copies the stream for the 'opus' codec and re-encodes anything else)
+        if self.encoder:
+            encoded_path = self.encoder.lookup(current_song.id, variant)
+            if encoded_path:
+                self.__pin(self.encoder.name(current_song.id, variant))
+                return discord.FFmpegOpusAudio(encoded_path, codec='opus', **self.ffmpeg_options)
+
+        song_path = self.audio_cache.lookup(current_song.id)
+        if song_path is None and self.streaming:
+            audio = await self.__stream(current_song, options)
+            if audio:
+                self.__encode(current_song, variant)
+                return audio
+
+        if song_path is None:
+            # Mark the song as wanted first, or scheduling for any player would cancel its download
+            self.prefetch()
+            download = self.downloads.get(current_song.id)
+
+            # A cancelled download can't be reused, so let it wind down and start again
+            if download and download['cancelled'].is_set():
+                await asyncio.wait([download['done']])
+                download = self.downloads.get(current_song.id)
+            if download is None:
+                download = self.downloads.fetch(current_song)
+
+            try:
+                await asyncio.shield(download['ready'])
+            except Exception as e:
+                logging.error(f'Failed to download {current_song.webpage_url}: {e}')
+                return
+            # Still being written under its partial name until the download finishes
+            song_path = self.downloads.path(current_song.id)
+
+        self.__encode(current_song, variant)
+        return discord.FFmpegOpusAudio(song_path, **options)
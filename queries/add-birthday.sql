@@ -1 +1 @@
-INSERT INTO birthdays(id, date) VALUES(?, ?)
\ No newline at end of file
+INSERT INTO birthdays(id, date, month_day) VALUES(?, ?, ?)
\ No newline at end of file
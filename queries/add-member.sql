@@ -1 +1 @@
-INSERT INTO members(id) VALUES(?)
+INSERT OR IGNORE INTO members(id) VALUES(?)
@@ -0,0 +1 @@
+INSERT OR REPLACE INTO track_cache(key, tracks, created, accessed) VALUES(?, ?, ?, ?)
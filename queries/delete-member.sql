@@ -0,0 +1,5 @@
+DELETE FROM members
+WHERE id = ?
+AND role IS NULL
+AND id NOT IN (SELECT member FROM reminders)
+AND id NOT IN (SELECT id FROM birthdays)
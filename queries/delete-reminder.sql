@@ -0,0 +1 @@
+DELETE FROM reminders WHERE id = ?
@@ -0,0 +1,7 @@
+DELETE FROM track_cache
+WHERE key IN (
+	SELECT key
+	FROM track_cache
+	ORDER BY accessed DESC
+	LIMIT -1 OFFSET ?
+)
@@ -1,5 +0,0 @@
-SELECT EXISTS (
-	SELECT id
-	FROM members
-	WHERE id = ?
-)
@@ -0,0 +1 @@
+DELETE FROM track_cache WHERE created < ?
@@ -0,0 +1,3 @@
+CREATE INDEX IF NOT EXISTS reminders_time ON reminders(time);
+CREATE INDEX IF NOT EXISTS reminders_member ON reminders(member);
+CREATE INDEX IF NOT EXISTS members_role ON members(role);
@@ -0,0 +1,11 @@
+-- Rebuilt rather than altered, since databases set up before migrations existed may already have month_day
+CREATE TABLE birthdays_migrated (
+	id INTEGER PRIMARY KEY,
+	date TEXT NOT NULL,
+	month_day TEXT,
+	FOREIGN KEY(id) REFERENCES members(id) ON DELETE SET NULL
+);
+INSERT INTO birthdays_migrated(id, date, month_day) SELECT id, date, strftime('%m-%d', date) FROM birthdays;
+DROP TABLE birthdays;
+ALTER TABLE birthdays_migrated RENAME TO birthdays;
+CREATE INDEX IF NOT EXISTS birthdays_month_day ON birthdays(month_day);
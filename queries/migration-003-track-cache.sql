@@ -0,0 +1,7 @@
+CREATE TABLE track_cache (
+	key TEXT PRIMARY KEY,
+	tracks TEXT NOT NULL,
+	created INTEGER NOT NULL,
+	accessed INTEGER NOT NULL
+);
+CREATE INDEX track_cache_accessed ON track_cache(accessed);
@@ -1,3 +1,3 @@
 SELECT id
 FROM birthdays
-WHERE strftime('%m-%d', date) = strftime('%m-%d', ?)
\ No newline at end of file
+WHERE month_day = ?
\ No newline at end of file
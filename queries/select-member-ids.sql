@@ -0,0 +1 @@
+SELECT id FROM members
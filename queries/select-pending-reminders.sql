@@ -0,0 +1,3 @@
+SELECT id, title, member, time
+FROM reminders
+ORDER BY time
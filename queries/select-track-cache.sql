@@ -0,0 +1,3 @@
+SELECT tracks
+FROM track_cache
+WHERE key = ? AND created >= ?
@@ -0,0 +1 @@
+UPDATE track_cache SET accessed = ? WHERE key = ?
@@ -1,3 +1,3 @@
 UPDATE birthdays
-SET date = ?
+SET date = ?, month_day = ?
 WHERE id = ?
\ No newline at end of file
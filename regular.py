@@ -1,8 +1,14 @@
 import common
 import handlers
 import database
+from notifications import Subscribers
+from roleedits import RolePositions
 
+import asyncio
+import functools
 import logging
+import time
+from collections import defaultdict
 from copy import copy
 
 import discord
@@ -14,40 +20,79 @@ class Regular(commands.Cog):
     def __init__(self, bot, settings):
         self.bot = bot
         self.settings = settings
+        self.subscribers = Subscribers(
+            sometimes_role=settings['roles']['sometimes_ping'],
+            always_role=settings['roles']['always_ping'],
+            channel_role=settings['roles']['channel_ping'],
+        )
+
+        self.role_positions = RolePositions()
+        self.role_locks = defaultdict(asyncio.Lock)
+
+        # Channel ID -> (name, handler), checked before mentions
+        self.routes = {
+            settings['channels']['games']: ('Notification', functools.partial(
+                handlers.handle_notifications,
+                subscribers=self.subscribers,
+                pings_channel=settings['channels']['pings'],
+            )),
+            settings['channels']['suggestions']: ('Suggestion', handlers.handle_suggestions),
+        }
+
+    def in_guild(self, member):
+        return member.guild.id == self.settings['guild']
+
+    @commands.Cog.listener()
+    async def on_ready(self):
+        guild = self.bot.get_guild(self.settings['guild'])
+        self.subscribers.build(guild.members)
 
     @commands.Cog.listener()
     async def on_member_join(self, member):
         if member.bot:
             return
 
+        if self.in_guild(member):
+            self.subscribers.update(member)
+
         # A welcoming message
         embed = discord.Embed(title='Welcome to Sketchspace!', description='A community for playing art games')
         await common.send_dm_embed(embed, member)
 
-        database.add_member(member, self.settings['paths']['database'])
+        await database.add_member(member, self.settings['paths']['database'])
         logging.info(f'Member {member} joined')
 
+    @commands.Cog.listener()
+    async def on_member_remove(self, member):
+        if self.in_guild(member):
+            self.subscribers.remove(member)
+
+    @commands.Cog.listener()
+    async def on_member_update(self, before, after):
+        # Also carries status changes on discord.py versions without on_presence_update
+        if self.in_guild(after):
+            self.subscribers.update(after)
+
+    @commands.Cog.listener()
+    async def on_presence_update(self, before, after):
+        if self.in_guild(after):
+            self.subscribers.update(after)
+
     @commands.Cog.listener()
     async def on_message(self, message):
-        # Game notifications
-        if message.channel == self.bot.get_channel(self.settings['channels']['games']):
-            await handlers.handle_notifications(
-                message,
-                sometimes_role=self.settings['roles']['sometimes_ping'],
-                always_role=self.settings['roles']['always_ping'],
-                channel_role=self.settings['roles']['channel_ping'],
-                pings_channel=self.settings['channels']['pings'],
-            )
-            logging.info('Notification handled')
-        # Suggestions
-        elif message.channel == self.bot.get_channel(self.settings['channels']['suggestions']):
-            await handlers.handle_suggestions(message)
-            logging.info('Suggestion handled')
-            return
+        route = self.routes.get(message.channel.id)
+        if route:
+            name, handler = route
         # Mentions
-        elif self.bot.user.mentioned_in(message):
-            await handlers.handle_mentions(message)
-            logging.info('Mention handled')
+        elif (message.mentions or message.mention_everyone) and self.bot.user.mentioned_in(message):
+            name, handler = 'Mention', handlers.handle_mentions
+        else:
+            return
+
+        start = time.perf_counter()
+        await handler(message)
+        elapsed = (time.perf_counter() - start) * 1000
+        logging.info(f'{name} handled in {elapsed:.1f}ms')
 
     @commands.command()
     async def role(self, ctx, color, *name):
@@ -55,31 +100,35 @@ class Regular(commands.Cog):
         name = ' '.join(name)
         color = common.hex_to_color(color)
 
-        with database.db(self.settings['paths']['database']) as cursor:
-            query = common.read_file('queries/select-member.sql')
-            role_assigned = cursor.execute(query, (ctx.author.id,)).fetchone()
+        db_path = self.settings['paths']['database']
+
+        # Only one !role per member at a time, so a burst can't create two roles for them
+        async with self.role_locks[ctx.author.id]:
+            role_assigned = await database.get_member_role(ctx.author, db_path)
 
             # If no assigned role, create a new one
-            if role_assigned[0] == None:
+            if role_assigned == None:
                 role = await ctx.guild.create_role(name=name, color=color)
                 old_role = None
                 new_role = role
 
-                # Set role position above the generic roles
+                # Set role position above the generic roles and add it to the user together
                 boundary_role = ctx.guild.get_role(self.settings['roles']['custom_boundary'])
-                role_position = boundary_role.position + 1
-                await role.edit(position=role_position)
-
-                # Add to user and database
-                await ctx.author.add_roles(role)
-
-                query = common.read_file('queries/add-role.sql')
-                cursor.execute(query, (role.id,))
-
-                query = common.read_file('queries/set-role.sql')
-                cursor.execute(query, (role.id, ctx.author.id))
+                try:
+                    await asyncio.gather(
+                        self.role_positions.move_above(role, boundary_role),
+                        ctx.author.add_roles(role),
+                    )
+                except:
+                    # Don't leave the role in a batched move once it's gone
+                    self.role_positions.cancel(role)
+                    await role.delete()
+                    raise
+
+                # Only recorded once Discord has everything
+                await database.set_member_role(ctx.author, role, db_path)
             else:
-                role = ctx.guild.get_role(role_assigned[0])
+                role = ctx.guild.get_role(role_assigned)
                 old_role = copy(role)
 
                 if name == '':
@@ -1,8 +1,8 @@
 import common
 import handlers
 import database
+from scheduler import Scheduler
 
-import asyncio
 import logging
 from copy import copy
 from datetime import datetime, timedelta, timezone
@@ -12,58 +12,79 @@ from discord.ext import commands
 
 logging.basicConfig(filename='log.txt', level=logging.INFO)
 
+# Keeps a batched birthday message within Discord's embed description limit
+BIRTHDAY_MENTIONS_PER_MESSAGE = 100
+
 class Reminders(commands.Cog):
     def __init__(self, bot, settings):
         self.bot = bot
         self.settings = settings
-    
-    async def poll(bot, settings):
-        INTERVAL = 60
-        db_path = settings['paths']['database']
-        channel = bot.get_channel(settings['channels']['reminders'])
-
-        while True:
-            now = datetime.now(timezone.utc)
-            soon = now + timedelta(seconds=INTERVAL)
-
-            # Check for reminders
-            try:
-                reminders = database.get_reminders(soon, db_path)
-                if reminders:
-                    for reminder in reminders:
-                        title = reminder[0]
-                        member = bot.get_user(reminder[1])
-
-                        await channel.send(embed=common.create_embed({
-                            'title': 'Reminder',
-                            'description': title,
-                        }))
-
-                        logging.info("Sent reminder!")
-                    
-                    database.delete_reminders(soon, db_path)
-            except:
-                logging.error("Failed to send reminder")
-
-            # Check for birthdays
-            try:
-                if now.day != soon.day:
-                    birthdays = database.get_birthdays(soon, db_path)
-                    if birthdays:
-
-                        for birthday in birthdays:
-                            member = bot.get_user(birthday[0])
-
-                            await channel.send(embed=common.create_embed({
-                                'title': 'Birthday',
-                                'description': f'Happy birthday, {member.mention}!',
-                            }))
-                    
-                            logging.info("Sent birthday wishes!")
-            except:
-                logging.error("Failed to send birthday wishes")
-
-            await asyncio.sleep(INTERVAL)
+        self.scheduler = Scheduler()
+        # Reminders set while the stored ones load would otherwise be scheduled twice
+        self.scheduled = set()
+        self.running = False
+
+    async def start(self):
+        """Load stored reminders and deliver everything at its due time."""
+        if self.running:
+            return
+        self.running = True
+
+        db_path = self.settings['paths']['database']
+        for id, title, member, time in await database.get_pending_reminders(db_path):
+            self.schedule_reminder(time, id, title, member)
+
+        self.schedule_birthdays(datetime.now(timezone.utc))
+        await self.scheduler.run()
+
+    def schedule_reminder(self, time, id, title, member):
+        """Schedule a stored reminder, unless it already is."""
+        if id in self.scheduled:
+            return
+        self.scheduled.add(id)
+        self.scheduler.schedule(time, self.send_reminder, id, title, member)
+
+    def schedule_birthdays(self, now):
+        """Schedule birthday wishes for the next midnight."""
+        midnight = datetime.combine(now.date() + timedelta(days=1), datetime.min.time(), tzinfo=timezone.utc)
+        self.scheduler.schedule(midnight.timestamp(), self.send_birthdays, midnight)
+
+    async def send_reminder(self, id, title, member):
+        channel = self.bot.get_channel(self.settings['channels']['reminders'])
+
+        try:
+            await channel.send(embed=common.create_embed({
+                'title': 'Reminder',
+                'description': title,
+            }))
+            logging.info("Sent reminder!")
+        except:
+            logging.error("Failed to send reminder")
+
+        await database.delete_reminder(id, self.settings['paths']['database'])
+        self.scheduled.discard(id)
+
+    async def send_birthdays(self, date):
+        channel = self.bot.get_channel(self.settings['channels']['reminders'])
+        self.schedule_birthdays(date)
+
+        try:
+            birthdays = await database.get_birthdays(date, self.settings['paths']['database'])
+            users = [self.bot.get_user(birthday[0]) for birthday in birthdays]
+            mentions = [user.mention for user in users if user]
+
+            # One message for everyone sharing the day
+            for start in range(0, len(mentions), BIRTHDAY_MENTIONS_PER_MESSAGE):
+                names = ', '.join(mentions[start:start + BIRTHDAY_MENTIONS_PER_MESSAGE])
+                await channel.send(embed=common.create_embed({
+                    'title': 'Birthday',
+                    'description': f'Happy birthday, {names}!',
+                }))
+
+            if mentions:
+                logging.info("Sent birthday wishes!")
+        except:
+            logging.error("Failed to send birthday wishes")
 
     @commands.command(aliases=['reminder', 'remindme'])
     async def remind(self, ctx, time, *title):
@@ -73,7 +94,8 @@ class Reminders(commands.Cog):
 
         time = common.extract_time(datetime.now(timezone.utc), time)
         db_path = self.settings['paths']['database']
-        database.add_reminder(title, member, time, db_path)
+        id = await database.add_reminder(title, member, time, db_path)
+        self.schedule_reminder(time.timestamp(), id, title, member.id)
 
         await ctx.message.add_reaction('👍')
         logging.info('Set reminder!')
@@ -86,13 +108,12 @@ class Reminders(commands.Cog):
         # YYYY-MM-DD
         try:
             date = datetime.strptime(date, '%Y-%m-%d')
-        # MM-DD
-        except:
-            date = f'0000-{date}'
-            date = datetime.strptime(date, f'%m-%d')
+        # MM-DD, read in a leap year so that 02-29 is accepted
+        except ValueError:
+            date = datetime.strptime(f'2000-{date}', '%Y-%m-%d')
 
         db_path = self.settings['paths']['database']
-        database.add_birthday(member, date, db_path)
+        await database.add_birthday(member, date, db_path)
 
         await ctx.message.add_reaction('👍')
         logging.info('Set birthday!')
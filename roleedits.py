@@ -0,0 +1,134 @@
+import asyncio
+import logging
+
+# Seconds to wait for more reactions from a member before editing their roles
+ROLE_EDIT_DELAY = 2
+ROLE_EDIT_CONCURRENCY = 5
+# Seconds to wait for other new roles before moving them all in one request
+ROLE_POSITION_DELAY = 0.5
+
+class RoleEdits():
+    """Merges the role changes a member makes within a short window into one edit."""
+    def __init__(self, delay=ROLE_EDIT_DELAY, concurrency=ROLE_EDIT_CONCURRENCY):
+        self.delay = delay
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.pending = {}
+        # The event loop only keeps weak references to tasks, so they are kept here until they finish
+        self.tasks = set()
+
+        self.requested = 0
+        self.issued = 0
+
+    def add(self, member, role):
+        """Queue a role to be given to a member."""
+        self.queue(member, role, True)
+
+    def remove(self, member, role):
+        """Queue a role to be taken from a member."""
+        self.queue(member, role, False)
+
+    def queue(self, member, role, add):
+        self.requested += 1
+
+        # The latest change to each role wins, so an add followed by a remove cancels out
+        if member.id in self.pending:
+            self.pending[member.id]['member'] = member
+            self.pending[member.id]['changes'][role.id] = (role, add)
+        else:
+            self.pending[member.id] = {'member': member, 'changes': {role.id: (role, add)}}
+            task = asyncio.ensure_future(self.flush(member.id))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+    async def flush(self, member_id):
+        await asyncio.sleep(self.delay)
+
+        async with self.semaphore:
+            pending = self.pending.pop(member_id)
+            # Build on the freshest cached roles, as other changes may have landed during the delay
+            member = pending['member']
+            member = member.guild.get_member(member_id) or member
+
+            roles = {role.id: role for role in member.roles if not role.is_default()}
+            before = set(roles)
+            for role_id, (role, add) in pending['changes'].items():
+                if add:
+                    roles[role_id] = role
+                else:
+                    roles.pop(role_id, None)
+
+            if set(roles) == before:
+                return
+
+            # This replaces the member's whole role list. A change made by someone else while this
+            # request waits out a rate limit is overwritten, which is the price of one request
+            # per burst instead of one per reaction.
+            try:
+                await member.edit(roles=list(roles.values()))
+                self.issued += 1
+                logging.info(
+                    f'Roles for member {member} updated '
+                    f'({self.issued} edits issued for {self.requested} requested changes)'
+                )
+            except Exception as e:
+                logging.error(e)
+
+class RolePositions():
+    """Batches role moves requested close together into one position update per guild."""
+    def __init__(self, delay=ROLE_POSITION_DELAY):
+        self.delay = delay
+        self.pending = {}
+        self.tasks = set()
+
+    async def move_above(self, role, boundary):
+        """Move a role just above another, sharing the request with any moves queued meanwhile."""
+        guild = role.guild
+
+        batch = self.pending.get(guild.id)
+        if batch is None:
+            batch = {'boundary': boundary, 'roles': {}}
+            self.pending[guild.id] = batch
+            task = asyncio.ensure_future(self.flush(guild))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+        moved = asyncio.get_running_loop().create_future()
+        batch['roles'][role] = moved
+
+        # Shielded so one cancelled caller doesn't cancel the move for everyone else
+        await asyncio.shield(moved)
+
+    def cancel(self, role):
+        """Take a role out of its guild's pending batch, e.g. before deleting it."""
+        batch = self.pending.get(role.guild.id)
+        if batch is None:
+            return
+
+        moved = batch['roles'].pop(role, None)
+        if moved and not moved.done():
+            moved.cancel()
+
+    async def flush(self, guild):
+        await asyncio.sleep(self.delay)
+        batch = self.pending.pop(guild.id)
+        if not batch['roles']:
+            return
+
+        position = batch['boundary'].position + 1
+        positions = {role: position + index for index, role in enumerate(batch['roles'])}
+        try:
+            await guild.edit_role_positions(positions=positions)
+            for moved in batch['roles'].values():
+                moved.set_result(None)
+            logging.info(f'Moved {len(positions)} roles in one request')
+            return
+        except Exception as e:
+            logging.error(f'Failed to move {len(positions)} roles together, moving them one at a time: {e}')
+
+        # One bad role shouldn't fail everyone else's move
+        for role, moved in batch['roles'].items():
+            try:
+                await role.edit(position=positions[role])
+                moved.set_result(None)
+            except Exception as e:
+                moved.set_exception(e)
@@ -1,5 +1,6 @@
-import common
-from database import db
+import database
+from autoroles import Autoroles
+from roleedits import RoleEdits
 
 import logging
 
@@ -12,19 +13,12 @@ class Roles(commands.Cog):
     def __init__(self, bot, settings):
         self.bot = bot
         self.settings = settings
-        self.autoroles = common.read_json(settings['paths']['autoroles'])['autoroles']
+        self.autoroles = Autoroles(settings['paths']['autoroles'])
+        self.role_edits = RoleEdits()
 
     @commands.Cog.listener()
     async def on_guild_role_delete(self, role):
-        with database.db(self.settings['paths']['database']) as cursor:
-            query = common.read_file('queries/exists-role.sql')
-            role_is_relevant = cursor.execute(query, (role.id,)).fetchone()
-            if role_is_relevant[0] != 0:
-                query = common.read_file('queries/delete-role.sql')
-                cursor.execute(query, (role.id,))
-
-                query = common.read_file('queries/null-role.sql')
-                cursor.execute(query, (role.id,))
+        await database.delete_role(role, self.settings['paths']['database'])
         logging.info(f'Role {role} deleted')
 
     @commands.Cog.listener()
@@ -34,11 +28,14 @@ class Roles(commands.Cog):
         if self.settings['setup']['autoroles']:
             return
 
+        role_id = self.autoroles.get_role_id(payload.message_id, payload.emoji.name)
+        if role_id is None:
+            return
+
         guild = self.bot.get_guild(self.settings['guild'])
-        data = common.get_autorole_data(payload.message_id, self.autoroles)
-        role = common.get_autorole_role_from_reaction(payload.emoji.name, data, guild)
-        await payload.member.add_roles(role)
-        logging.info(f'Role {role} added to member {payload.member}')
+        role = guild.get_role(role_id)
+        self.role_edits.add(payload.member, role)
+        logging.info(f'Role {role} queued for member {payload.member}')
 
     @commands.Cog.listener()
     async def on_raw_reaction_remove(self, payload):
@@ -47,10 +44,12 @@ class Roles(commands.Cog):
         if self.settings['setup']['autoroles']:
             return
 
-        guild = self.bot.get_guild(self.settings['guild'])
-        data = common.get_autorole_data(payload.message_id, self.autoroles)
-        role = common.get_autorole_role_from_reaction(payload.emoji.name, data, guild)
+        role_id = self.autoroles.get_role_id(payload.message_id, payload.emoji.name)
+        if role_id is None:
+            return
 
+        guild = self.bot.get_guild(self.settings['guild'])
+        role = guild.get_role(role_id)
         member = guild.get_member(payload.user_id)
-        await member.remove_roles(role)
-        logging.info(f'Role {role} removed from member {member}')
\ No newline at end of file
+        self.role_edits.remove(member, role)
+        logging.info(f'Role {role} queued for removal from member {member}')
\ No newline at end of file
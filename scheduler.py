@@ -0,0 +1,47 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+
+class Scheduler():
+    """Runs coroutine callbacks at set times, sleeping until the earliest one is due."""
+    def __init__(self):
+        self.heap = []
+        self.counter = itertools.count()
+        self.changed = asyncio.Event()
+
+    def __len__(self):
+        return len(self.heap)
+
+    def schedule(self, when, callback, *args):
+        """Schedule a coroutine function to be awaited at a UNIX timestamp."""
+        entry = (when, next(self.counter), callback, args)
+        heapq.heappush(self.heap, entry)
+
+        # Only an earlier deadline needs to cut the current sleep short
+        if self.heap[0] is entry:
+            self.changed.set()
+
+    async def run(self):
+        """Await each callback when it is due, forever."""
+        while True:
+            self.changed.clear()
+
+            if not self.heap:
+                await self.changed.wait()
+                continue
+
+            delay = self.heap[0][0] - time.time()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self.changed.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            _, _, callback, args = heapq.heappop(self.heap)
+            try:
+                await callback(*args)
+            except Exception as e:
+                logging.error(e)
@@ -21,10 +21,9 @@ import discord
 from discord.ext import commands
 
 SETTINGS = common.read_json('config.json')
-AUTOROLES = common.read_json(SETTINGS['paths']['autoroles'])['autoroles']
 
 logging.basicConfig(filename='log.txt', level=logging.INFO)
-database.setup(SETTINGS['paths']['database'])
+database.setup(SETTINGS['paths']['database'], **SETTINGS.get('sqlite', {}))
 
 intents = discord.Intents.default()
 intents.guilds = True
@@ -50,7 +49,7 @@ async def on_ready():
 
     # Create auto-role messages
     if SETTINGS['setup']['autoroles']:
-        for autorole in AUTOROLES:
+        for autorole in bot.get_cog('Roles').autoroles.autoroles:
             if autorole['message'] != 0:
                 continue
 
@@ -69,10 +68,10 @@ async def on_ready():
         logging.info('Please set the message IDs in the autoroles.json file and disable the SKETCHY_SETUP_AUTOROLES flag before restarting')
         exit()
 
-    members = bot.get_all_members()
-    database.update_members(members, SETTINGS['paths']['database'])
+    members = list(bot.get_all_members())
+    await database.update_members(members, SETTINGS['paths']['database'])
 
-    await Reminders.poll(bot, SETTINGS)
+    await bot.get_cog('Reminders').start()
 
 bot.add_cog(Admin(bot, SETTINGS))
 bot.add_cog(Regular(bot, SETTINGS))